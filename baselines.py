@@ -1,3 +1,8 @@
+import functools
+import json
+
+from simulator import BayesianGameSimulator
+
 def get_full_revelation_scheme(states):
     """
     Generates the Full Revelation scheme.
@@ -56,4 +61,31 @@ def calculate_theoretical_optimum(scenario_name, game_definition):
     else:
         # Undefined scenarios
         print(f"Warning: Theoretical optimum for {scenario_name} is not defined.")
-        return None, -float('inf')
\ No newline at end of file
+        return None, -float('inf')
+
+@functools.lru_cache(maxsize=None)
+def _revelation_utilities(game_json):
+    game_def = json.loads(game_json)
+    sim = BayesianGameSimulator(
+        states=game_def['states'],
+        actions=game_def['actions'],
+        prior=game_def['prior'],
+        sender_utility=game_def['u_s'],
+        receiver_utility=game_def['u_r']
+    )
+
+    u_full_rev = sim.calculate_sender_expected_utility(get_full_revelation_scheme(game_def['states']))
+    u_no_rev = sim.calculate_sender_expected_utility(get_no_revelation_scheme(game_def['states']))
+    return u_full_rev, u_no_rev
+
+def compute_baselines(scenario):
+    """
+    Returns (u_full_revelation, u_no_revelation, u_theoretical_optimum) for a scenario.
+    The two simulator utilities only depend on the game definition, so they are
+    memoized in memory. The optimum is looked up fresh on every call, so edits
+    to calculate_theoretical_optimum always take effect.
+    """
+    game_def = {key: scenario[key] for key in ('states', 'actions', 'prior', 'u_s', 'u_r')}
+    u_full_rev, u_no_rev = _revelation_utilities(json.dumps(game_def, sort_keys=True))
+    _, u_opt = calculate_theoretical_optimum(scenario['name'], game_def)
+    return u_full_rev, u_no_rev, u_opt
@@ -1,5 +1,10 @@
+import asyncio
 import json
+import math
 import os
+import random
+import tempfile
+import threading
 import time
 
 # --- API-Specific Imports ---
@@ -8,6 +13,125 @@ try:
 except ImportError:
     print("Warning: 'openai' library not found. OpenAI provider will not work.")
 
+# httpx is optional: without it the clients keep their default transport
+# (no tuned connection pool or HTTP/2)
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# orjson parses and serializes JSON several times faster than the standard library.
+# Its JSONDecodeError subclasses json.JSONDecodeError, so error handling is the same.
+try:
+    import orjson
+
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+POE_BASE_URL = "https://api.poe.com/v1"
+
+# Model used by the "openai" and "openai-batch" providers
+OPENAI_MODEL = "gpt-4-turbo" # Or "gpt-3.5-turbo"
+
+# Constrain OpenAI output to the scheme's JSON Schema (Structured Outputs) instead of
+# plain JSON mode. Requires a model that supports it, e.g. "gpt-4o"; gpt-4-turbo does not.
+OPENAI_USE_JSON_SCHEMA = False
+
+# How often a request is retried on transient API errors (rate limits, connection
+# problems, 5xx), with exponential backoff.
+MAX_RETRIES = 3
+
+# How often an output that is not a valid scheme is requested again (with the same
+# backoff). Off by default: retried runs report the Scheme Validity Rate over
+# first attempts, but 0 keeps results comparable with runs made before this option.
+MAX_SCHEME_RETRIES = 0
+
+# --- Shared API Clients ---
+# Clients are created on first use and then reused, so all calls share one
+# pool of keep-alive connections instead of rebuilding the HTTP client and
+# repeating the TLS handshake on every request.
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+def _make_http_client(use_async):
+    """
+    Builds the pooled httpx client used by an OpenAI-compatible client.
+    HTTP/2 lets concurrent requests share a single connection.
+    Returns None if httpx is not installed, so the client builds its default one.
+    """
+    if httpx is None:
+        return None
+    client_cls = openai.DefaultAsyncHttpxClient if use_async else openai.DefaultHttpxClient
+    limits = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+    try:
+        return client_cls(http2=True, limits=limits)
+    except ImportError:
+        # HTTP/2 needs the optional 'h2' package (pip install "httpx[http2]")
+        return client_cls(limits=limits)
+
+def _get_client(provider, use_async=True):
+    """
+    Returns the shared client for provider "openai" or "poe".
+    Async clients are bound to the event loop they were created in,
+    so one is kept per running loop; close them with close_async_clients()
+    before that loop ends.
+    """
+    loop = asyncio.get_running_loop() if use_async else None
+    key = (provider, use_async, loop)
+
+    with _CLIENTS_LOCK:
+        client = _CLIENTS.get(key)
+        if client is not None:
+            return client
+
+        # Forget clients whose event loop finished without close_async_clients()
+        for stale_key in [k for k in _CLIENTS if k[2] is not None and k[2].is_closed()]:
+            del _CLIENTS[stale_key]
+
+        if provider == "poe":
+            api_key = os.environ.get("POE_API_KEY")
+            if not api_key:
+                raise ValueError("POE_API_KEY environment variable not set.")
+            base_url = POE_BASE_URL
+        else:
+            api_key = os.environ.get("OPENAI_API_KEY")
+            if not api_key:
+                raise ValueError("OPENAI_API_KEY environment variable not set.")
+            base_url = None
+
+        client_cls = openai.AsyncOpenAI if use_async else openai.OpenAI
+        # Retries are handled by _with_retries, so the client's own retry loop is disabled
+        client = client_cls(api_key=api_key, base_url=base_url, max_retries=0,
+                            http_client=_make_http_client(use_async))
+        _CLIENTS[key] = client
+        return client
+
+async def close_async_clients():
+    """
+    Closes the shared async clients of the running event loop and their
+    connection pools. Call this before the loop ends (e.g. at the end of the
+    coroutine passed to asyncio.run).
+    """
+    loop = asyncio.get_running_loop()
+    with _CLIENTS_LOCK:
+        clients = [_CLIENTS.pop(key) for key in [k for k in _CLIENTS if k[2] is loop]]
+    for client in clients:
+        await client.close()
+
+async def _closing_clients(coro):
+    """
+    Awaits coro, then closes the async clients it opened in this event loop.
+    """
+    try:
+        return await coro
+    finally:
+        await close_async_clients()
+
 # --- Helper Functions (API-Agnostic) ---
 
 def _format_prompt(states, actions, prior, u_s, u_r):
@@ -46,56 +170,140 @@ Example Format:
     
     return f"{role_goal}\n\n{game_def}\n{output_format}"
 
-def validate_llm_scheme(scheme, states):
+def validate_llm_scheme(scheme, states_set):
     """
     Checks if the LLM output is a valid probability distribution.
     (This function is API-agnostic and validates the "output")
+    Checks every state in a single pass and stops at the first failure.
+    
+    :param states_set: frozenset of the game's states, built once by the caller
     """
     if not isinstance(scheme, dict):
         return False, "Output is not a dictionary."
     
-    if set(scheme.keys()) != set(states):
-        return False, f"Scheme keys {list(scheme.keys())} do not match states {states}."
+    # Dict keys are unique, so equal sizes plus every key being a state means the key set matches
+    if len(scheme) != len(states_set):
+        return False, f"Scheme keys {list(scheme.keys())} do not match states {sorted(states_set)}."
         
     for state, signals in scheme.items():
+        if state not in states_set:
+            return False, f"Scheme keys {list(scheme.keys())} do not match states {sorted(states_set)}."
         if not isinstance(signals, dict):
             return False, f"Signals for state {state} is not a dictionary."
         if not signals:
             return False, f"No signals defined for state {state}."
             
-        prob_sum = sum(signals.values())
+        prob_sum = math.fsum(signals.values())
         if not abs(prob_sum - 1.0) < 1e-6:
             return False, f"Probabilities for state {state} sum to {prob_sum}, not 1.0."
             
     return True, "Valid scheme."
 
+def parse_llm_output(raw_output, states_set):
+    """
+    Parses a raw LLM response and validates it as a signaling scheme.
+    (Shared by the online providers and the OpenAI Batch API path)
+    
+    :param states_set: frozenset of the game's states (see validate_llm_scheme)
+    :return: (scheme_dict, is_valid, status_message)
+    """
+    try:
+        llm_scheme = _json_loads(raw_output)
+        
+        is_valid, message = validate_llm_scheme(llm_scheme, states_set)
+        
+        if is_valid:
+            return llm_scheme, True, "Success"
+        else:
+            return None, False, f"Invalid scheme: {message}"
+
+    except json.JSONDecodeError:
+        return None, False, f"Failed to decode LLM output as JSON. Output was: {raw_output}"
+    except Exception as e:
+        return None, False, f"An unexpected error occurred: {e}"
+
 # --- API-Specific Implementations ---
 
-def _get_openai_strategy(prompt):
+# Providers that can return several independent completions for one request
+# (OpenAI's `n` parameter). Others are queried once per completion.
+MULTI_COMPLETION_PROVIDERS = ("openai", "openai-batch", "mock")
+
+async def _with_retries(request, max_retries=MAX_RETRIES):
+    """
+    Awaits request(), retrying rate-limit (429), connection and server (5xx)
+    errors with exponential backoff plus jitter. Other errors are raised at once.
+    """
+    retryable = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+    for attempt in range(max_retries + 1):
+        try:
+            return await request()
+        except retryable:
+            if attempt == max_retries:
+                raise
+            await asyncio.sleep(2 ** attempt + random.random())
+
+def _scheme_json_schema(states):
+    """
+    JSON Schema of a signaling scheme for the given states, used with
+    OpenAI Structured Outputs.
+    """
+    signal_probabilities = {
+        "type": "object",
+        "description": "Maps each signal name m to P(m | state); the values sum to 1.0.",
+        "additionalProperties": {"type": "number", "minimum": 0, "maximum": 1}
+    }
+    return {
+        "name": "signaling_scheme",
+        # Strict mode requires fixed keys, but the signal names are chosen by the model
+        "strict": False,
+        "schema": {
+            "type": "object",
+            "properties": {state: signal_probabilities for state in states},
+            "required": list(states),
+            "additionalProperties": False
+        }
+    }
+
+def _openai_request_body(prompt, states, n=1):
+    """
+    Builds the chat-completions request body for OpenAI.
+    Used both for online calls and as the "body" of each Batch API line.
+    With n > 1 the model returns n independent completions, while the
+    prompt tokens are billed only once.
+    """
+    if OPENAI_USE_JSON_SCHEMA:
+        response_format = {"type": "json_schema", "json_schema": _scheme_json_schema(states)}
+    else:
+        response_format = {"type": "json_object"} # Enforce JSON output
+
+    body = {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": "You must output only valid JSON."},
+            {"role": "user", "content": prompt}
+        ],
+        "response_format": response_format
+    }
+    if n > 1:
+        body["n"] = n
+    return body
+
+async def _get_openai_strategy(prompt, states, n=1):
     """
     Calls the OpenAI API.
+    Returns the content of all n completions as a list.
     """
     try:
-        # Initialize client here to ensure API key is read at call time
-        client = openai.OpenAI()
-        if not client.api_key:
-            raise ValueError("OPENAI_API_KEY environment variable not set.")
-            
-        completion = client.chat.completions.create(
-            model="gpt-4-turbo", # Or "gpt-3.5-turbo"
-            messages=[
-                {"role": "system", "content": "You must output only valid JSON."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format={"type": "json_object"} # Enforce JSON output
-        )
-        return completion.choices[0].message.content, None
+        client = _get_client("openai")
+        body = _openai_request_body(prompt, states, n)
+        completion = await _with_retries(lambda: client.chat.completions.create(**body))
+        return [choice.message.content for choice in completion.choices], None
     except Exception as e:
         return None, f"OpenAI API call failed: {e}"
 
-def _get_mock_strategy(prompt, states):
+async def _get_mock_strategy(prompt, states, n=1):
     """
-    Returns a hardcoded "mock" strategy for testing.
+    Returns n copies of a hardcoded "mock" strategy for testing.
     This does NOT call any API and is useful for debugging main.py.
     Now adapted to return valid schemes for different scenarios.
     """
@@ -120,28 +328,23 @@ def _get_mock_strategy(prompt, states):
         for state in states:
             mock_scheme[state] = {s: (1.0 if s == state else 0.0) for s in states}
     
-    time.sleep(0.5) # Simulate network delay
-    return json.dumps(mock_scheme), None
+    # Simulate network delay; set MOCK_FAST=1 to skip it (e.g. in CI)
+    if os.environ.get("MOCK_FAST") != "1":
+        await asyncio.sleep(0.5)
+    return [_json_dumps(mock_scheme)] * n, None
 
-def _get_poe_strategy(prompt, model_name="Claude-3.5-Sonnet"):
+async def _get_poe_strategy(prompt, model_name="Claude-3.5-Sonnet"):
     """
     Calls the Poe API to access various models using OpenAI-compatible format.
     
     Poe uses OpenAI-compatible API with base_url="https://api.poe.com/v1"
     """
     try:
-        api_key = os.environ.get("POE_API_KEY")
-        if not api_key:
-            raise ValueError("POE_API_KEY environment variable not set.")
-        
-        # Create OpenAI client with Poe's base URL
-        client = openai.OpenAI(
-            api_key=api_key,
-            base_url="https://api.poe.com/v1"
-        )
+        # Shared OpenAI client with Poe's base URL
+        client = _get_client("poe")
         
         # Call the API (non-streaming for simpler JSON parsing)
-        completion = client.chat.completions.create(
+        completion = await _with_retries(lambda: client.chat.completions.create(
             model=model_name,
             messages=[
                 {"role": "system", "content": "You must output only valid JSON."},
@@ -149,61 +352,226 @@ def _get_poe_strategy(prompt, model_name="Claude-3.5-Sonnet"):
             ],
             # Note: Poe may not support response_format, so we rely on prompt
             temperature=0.7
-        )
+        ))
         
         return completion.choices[0].message.content, None
         
     except Exception as e:
         return None, f"Poe API call failed: {e}"
 
-# --- Main Router Function ---
+# --- OpenAI Batch API ---
+# Submits every prompt of an experiment as one asynchronous batch job.
+# Batch requests are billed at roughly half the online price and do not
+# count against the per-minute rate limits, at the cost of latency
+# (results are guaranteed within the 24h completion window).
 
-def get_llm_strategy(states, actions, prior, u_s, u_r, provider="openai"):
+def submit_batch(prompts, prompt_states, n=1):
     """
-    Main entry point for getting an LLM strategy.
-    It formats the prompt, routes to the correct API provider, and validates the output.
+    Uploads the prompts as a JSONL batch input file and creates the batch job.
+    The i-th prompt (for a game with states prompt_states[i]) is submitted
+    with custom_id "prompt-{i}" and asks for n completions.
     
-    :param provider: str, "openai", "mock", or others you add
-    :return: (scheme_dict, is_valid, status_message)
+    :return: batch_id
     """
-    # 1. Format the API-agnostic prompt
-    prompt = _format_prompt(states, actions, prior, u_s, u_r)
+    client = _get_client("openai", use_async=False)
+
+    with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False, encoding="utf-8") as f:
+        for i, (prompt, states) in enumerate(zip(prompts, prompt_states)):
+            request = {
+                "custom_id": f"prompt-{i}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": _openai_request_body(prompt, states, n)
+            }
+            f.write(_json_dumps(request) + "\n")
+        input_path = f.name
+
+    try:
+        with open(input_path, "rb") as f:
+            input_file = client.files.create(file=f, purpose="batch")
+    finally:
+        os.remove(input_path)
+
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    return batch.id
+
+def wait_for_batch(batch_id, poll_interval=30):
+    """
+    Polls the batch job until it completes.
+    Raises RuntimeError if the job fails, expires or is cancelled.
     
-    raw_output = None
+    :return: the completed batch object
+    """
+    client = _get_client("openai", use_async=False)
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        if batch.status == "completed":
+            return batch
+        if batch.status in ("failed", "expired", "cancelled"):
+            raise RuntimeError(f"Batch {batch_id} ended with status '{batch.status}'.")
+
+        counts = batch.request_counts
+        progress = f" ({counts.completed}/{counts.total} done)" if counts else ""
+        print(f"  Batch {batch_id}: {batch.status}{progress}, checking again in {poll_interval}s...")
+        time.sleep(poll_interval)
+
+def get_batch_outputs(batch):
+    """
+    Downloads the results of a completed batch job.
+    
+    :return: dict mapping custom_id -> (list_of_raw_outputs, error)
+    """
+    client = _get_client("openai", use_async=False)
+    outputs = {}
+
+    if batch.output_file_id:
+        for line in client.files.content(batch.output_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = _json_loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") == 200:
+                raw_outputs = [choice["message"]["content"] for choice in response["body"]["choices"]]
+                outputs[record["custom_id"]] = (raw_outputs, None)
+            else:
+                outputs[record["custom_id"]] = (None, f"OpenAI batch request failed: {record.get('error') or response}")
+
+    # Requests that failed outright are reported in a separate error file
+    if batch.error_file_id:
+        for line in client.files.content(batch.error_file_id).text.splitlines():
+            if not line.strip():
+                continue
+            record = _json_loads(line)
+            outputs.setdefault(record["custom_id"], (None, f"OpenAI batch request failed: {record.get('error')}"))
+
+    return outputs
+
+# --- Main Router Function ---
+
+async def _request_raw_outputs(prompt, states, provider, n):
+    """
+    Routes the prompt to the specified provider and asks for n completions.
+    
+    :return: list of n (raw_output, error) tuples
+    """
+    raw_outputs = None
     error = None
     
-    # 2. Route to the specified provider
     if provider == "openai":
-        raw_output, error = _get_openai_strategy(prompt)
+        raw_outputs, error = await _get_openai_strategy(prompt, states, n)
     elif provider == "mock":
-        raw_output, error = _get_mock_strategy(prompt, states)
+        raw_outputs, error = await _get_mock_strategy(prompt, states, n)
     elif provider.startswith("poe-"):
         # Format: "poe-GPT-4" or "poe-Claude-3-Opus"
         model_name = provider[4:]  # Remove "poe-" prefix
-        raw_output, error = _get_poe_strategy(prompt, model_name)
+        # Poe does not support `n`, so issue one request per strategy
+        return await asyncio.gather(*(_get_poe_strategy(prompt, model_name) for _ in range(n)))
+    elif provider == "openai-batch":
+        # Batch jobs are submitted for a whole experiment at once, not per run
+        error = "Error: 'openai-batch' must be used via submit_batch() (see run_experiment in main.py)."
     # --- Future-proofing ---
     # elif provider == "anthropic":
-    #     raw_output, error = _get_anthropic_strategy(prompt)
+    #     raw_outputs, error = await _get_anthropic_strategy(prompt, n)
     # elif provider == "google_gemini":
-    #     raw_output, error = _get_gemini_strategy(prompt)
+    #     raw_outputs, error = await _get_gemini_strategy(prompt, n)
     else:
-        return None, False, f"Error: Unknown provider '{provider}'."
+        error = f"Error: Unknown provider '{provider}'."
 
     if error:
-        return None, False, error
-        
-    # 3. Parse and Validate the output (API-agnostic)
-    try:
-        llm_scheme = json.loads(raw_output)
-        
-        is_valid, message = validate_llm_scheme(llm_scheme, states)
-        
-        if is_valid:
-            return llm_scheme, True, "Success"
-        else:
-            return None, False, f"Invalid scheme: {message}"
+        return [(None, error)] * n
+    return [(raw_output, None) for raw_output in raw_outputs]
 
-    except json.JSONDecodeError:
-        return None, False, f"Failed to decode LLM output as JSON. Output was: {raw_output}"
-    except Exception as e:
-        return None, False, f"An unexpected error occurred: {e}"
\ No newline at end of file
+async def get_llm_strategy_from_prompt_async(prompt, states, provider="openai", n=1,
+                                             max_scheme_retries=MAX_SCHEME_RETRIES, states_set=None):
+    """
+    Asks the provider for n independent strategies for an already formatted
+    prompt and validates each output. Callers that query the same game
+    repeatedly should format the prompt once and reuse it here.
+    Providers in MULTI_COMPLETION_PROVIDERS answer with a single request;
+    the rest are queried n times concurrently.
+    Outputs that arrive but are not a valid scheme are requested again,
+    up to max_scheme_retries times.
+    
+    :param prompt: str, as returned by _format_prompt
+    :param provider: str, "openai", "mock", or others you add
+    :param n: int, number of strategies to generate
+    :param states_set: optional frozenset(states), for callers that cache it per scenario
+    :return: list of n (scheme_dict, is_valid, status_message, attempts) tuples,
+             where attempts counts the requests made for that strategy
+    """
+    if states_set is None:
+        states_set = frozenset(states)
+
+    # 1. Route to the specified provider
+    raw_outputs = await _request_raw_outputs(prompt, states, provider, n)
+
+    # 2. Parse and Validate each output (API-agnostic)
+    results = [(None, False, error) if error else parse_llm_output(raw_output, states_set)
+               for raw_output, error in raw_outputs]
+    attempts = [1] * len(results)
+
+    # 3. Re-request invalid outputs; provider errors were already retried by _with_retries
+    for attempt in range(max_scheme_retries):
+        invalid = [i for i, ((_, error), (_, is_valid, _)) in enumerate(zip(raw_outputs, results))
+                   if error is None and not is_valid]
+        if not invalid:
+            break
+        await asyncio.sleep(2 ** attempt + random.random())
+        retry_outputs = await _request_raw_outputs(prompt, states, provider, len(invalid))
+        for i, (raw_output, error) in zip(invalid, retry_outputs):
+            raw_outputs[i] = (raw_output, error)
+            results[i] = (None, False, error) if error else parse_llm_output(raw_output, states_set)
+            attempts[i] += 1
+
+    return [result + (attempt_count,) for result, attempt_count in zip(results, attempts)]
+
+async def get_llm_strategy_multi_async(states, actions, prior, u_s, u_r, provider="openai", n=1):
+    """
+    Main entry point for getting LLM strategies.
+    It formats the prompt once, then asks the provider for n independent
+    strategies (see get_llm_strategy_from_prompt_async).
+    
+    :param provider: str, "openai", "mock", or others you add
+    :param n: int, number of strategies to generate
+    :return: list of n (scheme_dict, is_valid, status_message) tuples
+    """
+    prompt = _format_prompt(states, actions, prior, u_s, u_r)
+    results = await get_llm_strategy_from_prompt_async(prompt, states, provider=provider, n=n)
+    return [(llm_scheme, is_valid, message) for llm_scheme, is_valid, message, _ in results]
+
+async def get_llm_strategy_async(states, actions, prior, u_s, u_r, provider="openai"):
+    """
+    Gets a single LLM strategy; see get_llm_strategy_multi_async.
+    
+    :param provider: str, "openai", "mock", or others you add
+    :return: (scheme_dict, is_valid, status_message)
+    """
+    results = await get_llm_strategy_multi_async(states, actions, prior, u_s, u_r, provider=provider, n=1)
+    return results[0]
+
+def get_llm_strategy_multi(states, actions, prior, u_s, u_r, provider="openai", n=1):
+    """
+    Blocking wrapper around get_llm_strategy_multi_async.
+    Must not be called from inside a running event loop.
+    
+    :return: list of n (scheme_dict, is_valid, status_message) tuples
+    """
+    return asyncio.run(_closing_clients(
+        get_llm_strategy_multi_async(states, actions, prior, u_s, u_r, provider=provider, n=n)
+    ))
+
+def get_llm_strategy(states, actions, prior, u_s, u_r, provider="openai"):
+    """
+    Blocking wrapper around get_llm_strategy_async for single, one-off calls.
+    Must not be called from inside a running event loop.
+    
+    :param provider: str, "openai", "mock", or others you add
+    :return: (scheme_dict, is_valid, status_message)
+    """
+    return asyncio.run(_closing_clients(
+        get_llm_strategy_async(states, actions, prior, u_s, u_r, provider=provider)
+    ))
\ No newline at end of file
@@ -1,6 +1,13 @@
+import argparse
+import asyncio
+import cProfile
+import csv
 import pandas as pd
+import pstats
 import os # Added for creating 'results' directory
-from simulator import BayesianGameSimulator
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from simulator import BayesianGameSimulator, USE_NUMBA, warm_up_kernel
 import baselines
 import llm_client
 from scenarios import all_scenarios
@@ -8,137 +15,398 @@ from scenarios import all_scenarios
 # --- Configuration ---
 
 # Number of times to run the LLM for each scenario to test robustness
-NUM_RUNS_PER_SCENARIO = 5 
+NUM_RUNS_PER_SCENARIO = 5
 
 # Specify the LLM provider. Use "openai" for real calls,
+# "openai-batch" to submit the whole experiment as one (half-price) Batch API job,
 # or "mock" for fast, free testing (as defined in llm_client.py)
-# LLM_PROVIDER = "openai" 
+# LLM_PROVIDER = "openai"
 LLM_PROVIDER = "poe-Claude-3.5-Sonnet"
 
-def run_experiment(scenarios, num_runs_per_scenario=NUM_RUNS_PER_SCENARIO):
+# Maximum number of LLM requests in flight at once (shared across scenario workers).
+# Lower this if the provider starts returning rate-limit (RPM) errors.
+LLM_CONCURRENCY_LIMIT = 8
+
+# Seconds between status checks while waiting for an "openai-batch" job
+BATCH_POLL_INTERVAL = 30
+
+RESULTS_PATH = "results/experiment_results.csv"
+
+# Columns of RESULTS_PATH, in order (one row per LLM run)
+RESULT_FIELDS = [
+    "scenario", "run", "u_llm", "u_theoretical_optimum", "u_full_revelation",
+    "u_no_revelation", "u_worst_baseline", "optimality_gap", "rpl",
+    "is_valid_scheme", "attempts", "llm_provider"
+]
+
+# Compact dtypes for loading RESULTS_PATH: the repeated labels become categoricals
+# and the metrics float32, which shrinks long sweeps and speeds up the groupby summary
+RESULT_DTYPES = {
+    "scenario": "category",
+    "llm_provider": "category",
+    "is_valid_scheme": "bool",
+    "attempts": "int8",
+    "u_llm": "float32",
+    "u_theoretical_optimum": "float32",
+    "u_full_revelation": "float32",
+    "u_no_revelation": "float32",
+    "u_worst_baseline": "float32",
+    "optimality_gap": "float32",
+    "rpl": "float32"
+}
+
+async def _gather_llm_strategies(prompt, game_def, num_runs_per_scenario, concurrency_limit, provider):
     """
-    Main experiment loop.
+    Requests num_runs_per_scenario strategies from provider for one scenario
+    concurrently, reusing its pre-formatted prompt.
+    Providers that support `n` get a single request; the others get one request per run.
+    Returns a list of (scheme_dict, is_valid, status_message, attempts), one per run.
     """
-    
+    semaphore = asyncio.Semaphore(concurrency_limit)
+
+    if provider in llm_client.MULTI_COMPLETION_PROVIDERS:
+        runs_per_request = num_runs_per_scenario
+    else:
+        runs_per_request = 1
+
+    # Build the state set once and share it across the validation calls
+    states_set = frozenset(game_def['states'])
+
+    async def _limited():
+        async with semaphore:
+            return await llm_client.get_llm_strategy_from_prompt_async(
+                prompt, game_def['states'], provider=provider, n=runs_per_request,
+                states_set=states_set
+            )
+
+    coros = [_limited() for _ in range(num_runs_per_scenario // runs_per_request)]
+    try:
+        responses = await asyncio.gather(*coros, return_exceptions=True)
+    finally:
+        # The shared clients are bound to this event loop, so release them before asyncio.run closes it
+        await llm_client.close_async_clients()
+
+    outputs = []
+    for response in responses:
+        if isinstance(response, Exception):
+            outputs.extend([(None, False, f"LLM request raised: {response}", 1)] * runs_per_request)
+        else:
+            outputs.extend(response)
+    return outputs
+
+def _collect_batch_strategies(prompts, game_defs, num_runs_per_scenario):
+    """
+    Submits the whole experiment as a single OpenAI Batch API job (one
+    request per scenario, asking for num_runs_per_scenario completions),
+    waits for it to finish, and maps each custom_id back to its scenario.
+    Invalid schemes are not re-requested, so every run has attempts == 1.
+    Returns one list of (scheme_dict, is_valid, status_message, attempts) per game definition.
+    """
+    batch_id = llm_client.submit_batch(
+        prompts, [game_def['states'] for game_def in game_defs], n=num_runs_per_scenario
+    )
+    print(f"Submitted batch {batch_id} with {len(prompts)} requests.")
+    batch = llm_client.wait_for_batch(batch_id, poll_interval=BATCH_POLL_INTERVAL)
+    batch_outputs = llm_client.get_batch_outputs(batch)
+
+    llm_outputs = []
+    for i, game_def in enumerate(game_defs):
+        raw_outputs, error = batch_outputs.get(f"prompt-{i}", (None, "No result returned for this request."))
+        if error:
+            llm_outputs.append([(None, False, error, 1)] * num_runs_per_scenario)
+        else:
+            states_set = frozenset(game_def['states'])
+            llm_outputs.append([llm_client.parse_llm_output(raw_output, states_set) + (1,)
+                                for raw_output in raw_outputs])
+    return llm_outputs
+
+def _game_def(scenario):
+    return {
+        'states': scenario['states'],
+        'actions': scenario['actions'],
+        'prior': scenario['prior'],
+        'u_s': scenario['u_s'],
+        'u_r': scenario['u_r']
+    }
+
+def _evaluate_scenario(scenario, scenario_outputs, provider):
+    """
+    Scores one scenario's LLM outputs (from provider) against its baselines.
+    Returns one result dict per LLM run. The log is printed as a single block
+    so output from parallel scenario workers does not interleave.
+    """
+    num_runs = len(scenario_outputs)
+    log = [f"--- Running Scenario: {scenario['name']} ---"]
+
+    # 1. Initialize the game simulator (the "Referee")
+    sim = BayesianGameSimulator(
+        states=scenario['states'],
+        actions=scenario['actions'],
+        prior=scenario['prior'],
+        sender_utility=scenario['u_s'],
+        receiver_utility=scenario['u_r']
+    )
+
+    # 2. Baseline Utilities and Theoretical Optimum (the "ceiling");
+    # the simulator baselines are memoized per game definition
+    u_full_rev, u_no_rev, u_opt = baselines.compute_baselines(scenario)
+
+    # Find the worst of the two simple baselines
+    worst_baseline_util = min(u_full_rev, u_no_rev)
+
+    log.append(f"  Baseline - Full Revelation: {u_full_rev:.4f}")
+    log.append(f"  Baseline - No Revelation: {u_no_rev:.4f}")
+    log.append(f"  Theoretical Optimum: {u_opt:.4f}")
+
+    # 3. Evaluate each LLM run
     results = []
+    for i, (llm_scheme, is_valid, message, attempts) in enumerate(scenario_outputs):
+        log.append(f"  LLM Run {i+1}/{num_runs}...")
+
+        # Initialize metrics for this run
+        u_llm = None
+        optimality_gap = None
+        rpl = None
+
+        if is_valid:
+            # 4. Run the valid LLM strategy in the simulator
+            # (cached: repeated identical schemes are only evaluated once)
+            u_llm = sim.calculate_sender_expected_utility_cached(llm_scheme)
+            log.append(f"    LLM Utility: {u_llm:.4f} (Valid, attempt {attempts})")
+
+            # 5. Calculate Evaluation Metrics
+
+            # Metric 1: Optimality Gap
+            # (How far is the LLM from the perfect score?)
+            if u_opt > 0: # Avoid division by zero
+                optimality_gap = (u_opt - u_llm) / u_opt #
+
+            # Metric 2: Relative Performance Level (RPL)
+            # (How much did the LLM improve over the worst baseline?)
+            denom_rpl = u_opt - worst_baseline_util
+            if denom_rpl > 0: # Avoid division by zero
+                rpl = (u_llm - worst_baseline_util) / denom_rpl #
+
+        else:
+            log.append(f"    LLM Run Failed: {message}")
+
+        # Store results for this run
+        results.append({
+            "scenario": scenario['name'],
+            "run": i + 1,
+            "u_llm": u_llm,
+            "u_theoretical_optimum": u_opt, #
+            "u_full_revelation": u_full_rev,
+            "u_no_revelation": u_no_rev,
+            "u_worst_baseline": worst_baseline_util, #
+            "optimality_gap": optimality_gap, #
+            "rpl": rpl, #
+            "is_valid_scheme": is_valid, #
+            "attempts": attempts,
+            "llm_provider": provider
+        })
+
+    print("\n".join(log), flush=True)
+    return results
+
+def run_one_scenario(scenario, provider, num_runs_per_scenario=NUM_RUNS_PER_SCENARIO,
+                     concurrency_limit=LLM_CONCURRENCY_LIMIT):
+    """
+    Runs the whole pipeline for a single scenario: all of its LLM runs
+    (concurrently, see _gather_llm_strategies), then the simulator evaluation.
+    Top-level and self-contained so it can run in a worker process; the provider
+    is passed in because workers started with "spawn" re-import this module and
+    would not see changes to LLM_PROVIDER made by the caller.
+    
+    :return: list of result dicts, one per LLM run
+    """
+    game_def = _game_def(scenario)
+    # The prompt only depends on the game definition, so format it once
+    prompt = llm_client._format_prompt(**game_def)
+
+    scenario_outputs = _request_llm_strategies(prompt, game_def, num_runs_per_scenario, concurrency_limit, provider)
+    return _evaluate_scenario(scenario, scenario_outputs, provider)
+
+def _request_llm_strategies(prompt, game_def, num_runs_per_scenario, concurrency_limit, provider):
+    """
+    Blocking entry point for one scenario's LLM runs. Kept as a plain function
+    so --profile can measure its wall time, network waits included.
+    """
+    return asyncio.run(
+        _gather_llm_strategies(prompt, game_def, num_runs_per_scenario, concurrency_limit, provider)
+    )
+
+def _stream_results(scenario_results_iter, output_path):
+    """
+    Writes result rows to output_path as each scenario finishes, flushing after
+    every scenario so completed work survives a crash or interrupt and the
+    rows never have to be held in memory all at once.
+    
+    :return: (total_llm_runs, first_attempt_valid_runs, total_llm_attempts, successful_llm_runs)
+    """
+    total_llm_runs = 0
+    first_attempt_valid_runs = 0
     total_llm_attempts = 0
     successful_llm_runs = 0
+
+    with open(output_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, lineterminator="\n")
+        writer.writeheader()
+        f.flush()
+
+        for scenario_results in scenario_results_iter:
+            for result in scenario_results:
+                writer.writerow(result)
+                total_llm_runs += 1
+                total_llm_attempts += result['attempts']
+                if result['is_valid_scheme']:
+                    successful_llm_runs += 1
+                    if result['attempts'] == 1:
+                        first_attempt_valid_runs += 1
+            f.flush()
+
+    return total_llm_runs, first_attempt_valid_runs, total_llm_attempts, successful_llm_runs
+
+def run_experiment(scenarios, num_runs_per_scenario=NUM_RUNS_PER_SCENARIO,
+                   concurrency_limit=LLM_CONCURRENCY_LIMIT, provider=None, in_process=False):
+    """
+    Main experiment loop.
+    Scenarios are independent, so each runs in a worker process
+    (run_one_scenario), with its LLM runs issued concurrently inside the worker.
+    The "openai-batch" provider instead submits the whole experiment as one job.
     
+    :param provider: LLM provider to use; defaults to LLM_PROVIDER
+    :param in_process: run the scenarios one after another in this process
+                       instead (used by --profile, so cProfile sees all the work)
+    """
+    if provider is None:
+        provider = LLM_PROVIDER
+
     # Ensure the 'results' directory exists
     os.makedirs("results", exist_ok=True)
-    
-    for scenario in scenarios:
-        print(f"--- Running Scenario: {scenario['name']} ---")
-        
-        # 1. Initialize the game simulator (the "Referee")
-        game_def = {
-            'states': scenario['states'],
-            'actions': scenario['actions'],
-            'prior': scenario['prior'],
-            'u_s': scenario['u_s'],
-            'u_r': scenario['u_r']
-        }
-        sim = BayesianGameSimulator(
-            states=scenario['states'],
-            actions=scenario['actions'],
-            prior=scenario['prior'],
-            sender_utility=scenario['u_s'],
-            receiver_utility=scenario['u_r']
+    output_path = RESULTS_PATH
+
+    if provider == "openai-batch":
+        game_defs = [_game_def(scenario) for scenario in scenarios]
+        prompts = [llm_client._format_prompt(**game_def) for game_def in game_defs]
+        llm_outputs = _collect_batch_strategies(prompts, game_defs, num_runs_per_scenario)
+        run_counts = _stream_results(
+            (_evaluate_scenario(scenario, scenario_outputs, provider)
+             for scenario, scenario_outputs in zip(scenarios, llm_outputs)),
+            output_path
+        )
+    elif in_process:
+        print(f"Running {len(scenarios)} scenarios in-process "
+              f"({num_runs_per_scenario} LLM runs each)...")
+        run_counts = _stream_results(
+            (run_one_scenario(scenario, provider, num_runs_per_scenario, concurrency_limit)
+             for scenario in scenarios),
+            output_path
         )
-        
-        # 2. Calculate Baseline Utilities
-        full_rev_scheme = baselines.get_full_revelation_scheme(scenario['states'])
-        u_full_rev = sim.calculate_sender_expected_utility(full_rev_scheme)
-        
-        no_rev_scheme = baselines.get_no_revelation_scheme(scenario['states'])
-        u_no_rev = sim.calculate_sender_expected_utility(no_rev_scheme)
-        
-        # Find the worst of the two simple baselines
-        worst_baseline_util = min(u_full_rev, u_no_rev)
-        
-        # 3. Calculate Theoretical Optimum (the "ceiling")
-        opt_scheme, u_opt = baselines.calculate_theoretical_optimum(scenario['name'], game_def)
-        
-        print(f"  Baseline - Full Revelation: {u_full_rev:.4f}")
-        print(f"  Baseline - No Revelation: {u_no_rev:.4f}")
-        print(f"  Theoretical Optimum: {u_opt:.4f}")
-        
-        # 4. Run LLM multiple times
-        for i in range(num_runs_per_scenario):
-            print(f"  LLM Run {i+1}/{num_runs_per_scenario}...")
-            total_llm_attempts += 1
-            
-            # 3. Get LLM-generated strategy
-            llm_scheme, is_valid, message = llm_client.get_llm_strategy(
-                **game_def, 
-                provider=LLM_PROVIDER
+    else:
+        # The LLM requests are I/O-bound and already concurrent inside each worker;
+        # extra processes only help the CPU-side work, so use at most one per core
+        num_workers = max(1, min(len(scenarios), os.cpu_count() or 1))
+        # Share the request budget between the workers
+        worker_concurrency_limit = max(1, concurrency_limit // num_workers)
+        print(f"Running {len(scenarios)} scenarios in {num_workers} worker processes "
+              f"({num_runs_per_scenario} LLM runs each)...")
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            run_counts = _stream_results(
+                executor.map(
+                    run_one_scenario,
+                    scenarios,
+                    repeat(provider),
+                    repeat(num_runs_per_scenario),
+                    repeat(worker_concurrency_limit)
+                ),
+                output_path
             )
-            
-            # Initialize metrics for this run
-            u_llm = None
-            optimality_gap = None
-            rpl = None
-            
-            if is_valid:
-                successful_llm_runs += 1
-                # 5. Run the valid LLM strategy in the simulator
-                u_llm = sim.calculate_sender_expected_utility(llm_scheme)
-                print(f"    LLM Utility: {u_llm:.4f} (Valid)")
-                
-                # 6. Calculate Evaluation Metrics
-                
-                # Metric 1: Optimality Gap
-                # (How far is the LLM from the perfect score?)
-                if u_opt > 0: # Avoid division by zero
-                    optimality_gap = (u_opt - u_llm) / u_opt #
-                
-                # Metric 2: Relative Performance Level (RPL)
-                # (How much did the LLM improve over the worst baseline?)
-                denom_rpl = u_opt - worst_baseline_util
-                if denom_rpl > 0: # Avoid division by zero
-                    rpl = (u_llm - worst_baseline_util) / denom_rpl #
-                
-            else:
-                print(f"    LLM Run Failed: {message}")
-
-            # Store results for this run
-            results.append({
-                "scenario": scenario['name'],
-                "run": i + 1,
-                "u_llm": u_llm,
-                "u_theoretical_optimum": u_opt, #
-                "u_full_revelation": u_full_rev,
-                "u_no_revelation": u_no_rev,
-                "u_worst_baseline": worst_baseline_util, #
-                "optimality_gap": optimality_gap, #
-                "rpl": rpl, #
-                "is_valid_scheme": is_valid, #
-                "llm_provider": LLM_PROVIDER
-            })
 
     # --- Experiment Finished ---
-    
-    # Calculate final metrics
-    scheme_validity_rate = successful_llm_runs / total_llm_attempts if total_llm_attempts > 0 else 0 #
-    
-    # Save all results to CSV
-    results_df = pd.DataFrame(results)
-    output_path = "results/experiment_results.csv"
-    results_df.to_csv(output_path, index=False)
-    
+
+    # Calculate final metrics. SVR only counts schemes that were valid on the first
+    # request, so re-requesting invalid ones (MAX_SCHEME_RETRIES) cannot inflate it
+    total_llm_runs, first_attempt_valid_runs, total_llm_attempts, successful_llm_runs = run_counts
+    scheme_validity_rate = first_attempt_valid_runs / total_llm_runs if total_llm_runs > 0 else 0 #
+
+    # Load the streamed results back only for the summary statistics
+    results_df = pd.read_csv(output_path, dtype=RESULT_DTYPES)
+
     print("\n--- Experiment Complete ---")
     print(f"Scheme Validity Rate (SVR): {scheme_validity_rate * 100:.2f}%") #
-    
+    if total_llm_attempts > total_llm_runs:
+        print(f"  Valid after re-requests: {successful_llm_runs}/{total_llm_runs} runs "
+              f"({total_llm_attempts} requests in total)")
+
     print("\nAverage Performance (on valid runs only):")
     valid_results_df = results_df[results_df['is_valid_scheme'] == True]
-    
+
     if not valid_results_df.empty:
         # Calculate mean metrics per scenario
-        print(valid_results_df.groupby('scenario')[['optimality_gap', 'rpl']].mean())
+        print(valid_results_df.groupby('scenario', observed=True)[['optimality_gap', 'rpl']].mean())
     else:
         print("No valid LLM runs were recorded.")
-        
+
     print(f"\nDetailed results saved to {output_path}")
 
+def _print_profile_report(profiler, top_n=20):
+    """
+    Prints the top_n functions by cumulative time, then how the time splits
+    between waiting on LLM requests and running the simulator.
+    """
+    stats = pstats.Stats(profiler).sort_stats(pstats.SortKey.CUMULATIVE)
+    print(f"\n--- Profile: top {top_n} functions by cumulative time ---")
+    stats.print_stats(top_n)
+
+    def cumulative_seconds(*function_names):
+        return sum(cumtime for (_, _, name), (_, _, _, cumtime, _) in stats.stats.items()
+                   if name in function_names)
+
+    # cProfile does not count the time a coroutine spends suspended on `await`, so the
+    # provider calls look cheap on their own. The blocking wrappers around the LLM phase
+    # capture its real wall time (any provider, network waits and event loop included).
+    llm_seconds = cumulative_seconds("_request_llm_strategies", "_collect_batch_strategies")
+    simulator_seconds = cumulative_seconds("calculate_sender_expected_utility")
+
+    print("--- Time Breakdown ---")
+    print(f"  LLM phase (all providers, incl. network wait): {llm_seconds:.4f}s")
+    print(f"  Simulator (calculate_sender_expected_utility): {simulator_seconds:.4f}s")
+
+    if llm_seconds >= simulator_seconds:
+        ratio = f"~{llm_seconds / simulator_seconds:,.0f}x" if simulator_seconds > 0 else "far"
+        print(f"  I/O-bound: the LLM phase takes {ratio} longer than the simulator.")
+        print("  Speed up by sending fewer or more concurrent requests (LLM_CONCURRENCY_LIMIT,")
+        print("  n completions per request, the \"openai-batch\" provider), not by optimizing the simulator.")
+    else:
+        print("  Compute-bound: the simulator dominates. Let scenarios run in parallel worker")
+        print("  processes (i.e. without --profile).")
+        if not USE_NUMBA:
+            print("  Set USE_NUMBA=1 (needs numba) for the compiled expected-utility kernel.")
+
+def profile_experiment(scenarios, num_runs_per_scenario=NUM_RUNS_PER_SCENARIO,
+                       concurrency_limit=LLM_CONCURRENCY_LIMIT, provider=None):
+    """
+    Runs the experiment in-process under cProfile and reports whether it is
+    I/O-bound (LLM requests) or compute-bound (simulator) on this machine.
+    """
+    # Pay the Numba import and compile / cache load up front so it is not counted as simulator time
+    warm_up_kernel()
+    profiler = cProfile.Profile()
+    profiler.runcall(run_experiment, scenarios, num_runs_per_scenario, concurrency_limit,
+                     provider=provider, in_process=True)
+    _print_profile_report(profiler)
+
 if __name__ == "__main__":
-    run_experiment(all_scenarios, num_runs_per_scenario=NUM_RUNS_PER_SCENARIO) #
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Evaluate LLM-designed signaling schemes.")
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="run in a single process under cProfile and report where the time goes "
+             "(LLM requests vs simulator)"
+    )
+    args = parser.parse_args()
+
+    if args.profile:
+        profile_experiment(all_scenarios, num_runs_per_scenario=NUM_RUNS_PER_SCENARIO)
+    else:
+        run_experiment(all_scenarios, num_runs_per_scenario=NUM_RUNS_PER_SCENARIO) #
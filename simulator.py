@@ -1,5 +1,89 @@
+import functools
+import os
+
 import numpy as np
 
+# The Numba-compiled kernel is opt-in: set USE_NUMBA=1 (needs the optional 'numba'
+# package). The simulator's share of an experiment is tiny next to the LLM requests,
+# while importing numba and loading the compiled kernel costs each worker process
+# about half a second, so by default the expected utility uses plain NumPy.
+USE_NUMBA = os.environ.get("USE_NUMBA") == "1"
+
+# Receiver expected utilities closer than this, relative to the largest |U_R(a, w)|,
+# are treated as a tie. Posteriors come out of a division, so actions that tie exactly
+# in theory (e.g. a pooled signal that leaves the Receiver indifferent) can differ by
+# rounding noise of ~1e-16 times the utility scale.
+TIE_TOLERANCE = 1e-9
+
+def _eu_kernel(pi, prior_v, Us, Ur, tie_tolerance):
+    """
+    Sender's expected utility for an (S, M) scheme matrix pi, written as plain
+    loops so Numba can compile it. Same result as the NumPy path in
+    BayesianGameSimulator.calculate_sender_expected_utility, including tie-breaking.
+    """
+    n_states, n_signals = pi.shape
+    n_actions = Ur.shape[0]
+    receiver_eu = np.empty(n_actions)
+    total_expected_utility = 0.0
+
+    for m in range(n_signals):
+        prob_signal = 0.0 # P(m)
+        for w in range(n_states):
+            prob_signal += pi[w, m] * prior_v[w]
+        if prob_signal <= 0.0:
+            continue # Impossible signal, contributes nothing
+
+        # Receiver's expected utility of each action under the posterior P(w | m)
+        for a in range(n_actions):
+            eu = 0.0
+            for w in range(n_states):
+                eu += Ur[a, w] * pi[w, m] * prior_v[w]
+            receiver_eu[a] = eu / prob_signal
+
+        # a*(m): the first action within tie_tolerance of the best
+        best_eu = receiver_eu.max()
+        a_star = 0
+        while receiver_eu[a_star] < best_eu - tie_tolerance:
+            a_star += 1
+
+        for w in range(n_states):
+            total_expected_utility += pi[w, m] * prior_v[w] * Us[a_star, w]
+
+    return total_expected_utility
+
+def scheme_key(signaling_scheme):
+    """
+    Hashable, key-order-independent form of a dict scheme {state: {signal: P(m | w)}},
+    used to cache utilities of identical schemes.
+    """
+    return tuple((state, tuple(sorted(signals.items()))) for state, signals in sorted(signaling_scheme.items()))
+
+@functools.lru_cache(maxsize=None)
+def _compiled_eu_kernel():
+    """
+    Returns _eu_kernel compiled with Numba, importing numba on first use,
+    or None if numba is not installed.
+    """
+    try:
+        from numba import njit
+    except ImportError:
+        print("Warning: USE_NUMBA is set but the 'numba' library was not found. Using NumPy instead.")
+        return None
+    # cache=True keeps the compiled code on disk, so only the very first run pays the JIT cost;
+    # nogil=True lets the kernel run in parallel with other threads
+    return njit(cache=True, nogil=True)(_eu_kernel)
+
+def warm_up_kernel():
+    """
+    With USE_NUMBA, imports numba and compiles (or loads from Numba's on-disk
+    cache) the expected-utility kernel on a 1x1 game, so the one-off cost is not
+    billed to the first real call. Does nothing otherwise.
+    """
+    kernel = _compiled_eu_kernel() if USE_NUMBA else None
+    if kernel is not None:
+        one = np.ones((1, 1))
+        kernel(one, np.ones(1), one, one, TIE_TOLERANCE)
+
 class BayesianGameSimulator:
     
     def __init__(self, states, actions, prior, sender_utility, receiver_utility):
@@ -9,80 +93,125 @@ class BayesianGameSimulator:
         self.u_s = sender_utility
         self.u_r = receiver_utility
 
+        # Per-instance memo of utilities by scheme_key (see calculate_sender_expected_utility_cached)
+        self._utility_by_scheme_key = functools.lru_cache(maxsize=1024)(self._utility_from_scheme_key)
+
+        # Stable integer index for the states; dict lookups by label only
+        # happen when converting inputs, all further math is on the arrays below
+        self.state_idx = {s: i for i, s in enumerate(states)}
+
+        # Dense copies of the game data (rows follow self.actions, columns self.states)
+        self.prior_v = np.array([prior[s] for s in states], dtype=float)                            # (S,)
+        self.Us = np.array([[sender_utility[a][s] for s in states] for a in actions], dtype=float)   # (A, S)
+        self.Ur = np.array([[receiver_utility[a][s] for s in states] for a in actions], dtype=float) # (A, S)
+
+        # Absolute tie tolerance for this game's receiver utilities (see TIE_TOLERANCE)
+        self.tie_tolerance = TIE_TOLERANCE * np.abs(self.Ur).max()
+
+    def _scheme_to_matrix(self, signaling_scheme):
+        """
+        Convert a dict scheme {state: {signal: P(m | w)}} into an (S, M) float matrix
+        pi[w, m] = P(m | w), with rows in self.states order and one column per
+        distinct signal, in order of first appearance.
+        """
+        signal_idx = {}
+        for state_signals in signaling_scheme.values():
+            for signal in state_signals:
+                signal_idx.setdefault(signal, len(signal_idx))
+
+        pi = np.zeros((len(self.states), len(signal_idx)))
+        for state, i in self.state_idx.items():
+            for signal, prob in signaling_scheme[state].items():
+                pi[i, signal_idx[signal]] = prob
+        return pi
+
     def _calculate_posterior_belief(self, signal, signaling_scheme):
         """
         Calculate Receiver's posterior belief P(state | signal) using Bayes' Rule.
         P(state | signal) = [P(signal | state) * P(state)] / P(signal)
+        
+        Debug helper for inspecting a single signal; calculate_sender_expected_utility
+        gets the posteriors of all signals at once from _signal_posteriors.
         """
-        prob_signal = 0.0 # P(signal)
-        for state in self.states: 
-            # P(signal | state) * P(state)
-            prob_signal += signaling_scheme[state].get(signal, 0) * self.prior[state]
+        # P(signal | state) * P(state), computed once per state
+        joint = {state: signaling_scheme[state].get(signal, 0) * self.prior[state] for state in self.states}
+        prob_signal = sum(joint.values()) # P(signal)
             
         if prob_signal == 0:
             # Avoid division by zero if signal is impossible
             # Return prior belief and 0 probability
             return self.prior, 0.0 
 
-        posterior_belief = {}
-        for state in self.states:
-            prob_signal_given_state = signaling_scheme[state].get(signal, 0)
-            prob_state = self.prior[state]
-            # Bayes' Rule
-            posterior_belief[state] = (prob_signal_given_state * prob_state) / prob_signal
-            
+        # Bayes' Rule
+        posterior_belief = {state: p_joint / prob_signal for state, p_joint in joint.items()}
         return posterior_belief, prob_signal
 
+    def _signal_posteriors(self, pi):
+        """
+        Bayes' Rule for every signal in one pass over the (S, M) scheme matrix pi.
+        Returns the joint table P(w, m) and the posteriors P(w | m), both (S, M).
+        Impossible signals (P(m) = 0) get an all-zero posterior column.
+        """
+        p_joint = pi * self.prior_v[:, None]             # P(w, m)
+        p_m = p_joint.sum(axis=0)                        # P(m), (M,)
+        posterior = p_joint / np.where(p_m > 0, p_m, 1)  # P(w | m)
+        return p_joint, posterior
+
     def _get_receiver_optimal_action(self, posterior_belief):
         """
-        Determine the rational Receiver's optimal action a*(m).
+        Determine the rational Receiver's optimal action a*(m)
+        for a posterior given as {state: P(w | signal)}.
         """
-        max_expected_utility = -float('inf')
-        optimal_action = None
-        
-        for action in self.actions:
-            expected_utility = 0.0
-            for state in self.states:
-                # E[U_R(a, w) | signal] = Sum [ U_R(a, w) * P(w | signal) ]
-                expected_utility += self.u_r[action][state] * posterior_belief[state]
-            
-            if expected_utility > max_expected_utility:
-                max_expected_utility = expected_utility
-                optimal_action = action
-                
-        return optimal_action # a*(m)
+        belief = np.array([posterior_belief[state] for state in self.states])
+        return self.actions[int(self._receiver_best_actions(belief[:, None])[0])] # a*(m)
+
+    def _receiver_best_actions(self, posterior):
+        """
+        Indices of the Receiver's optimal actions for every signal at once.
+        posterior is (S, M); returns a (M,) int array.
+        Ties (within self.tie_tolerance) go to the earliest action in self.actions.
+        """
+        # E[U_R(a, w) | m] = Sum_w U_R(a, w) * P(w | m) for all actions and signals, (A, M)
+        receiver_eu = self.Ur @ posterior
+        # argmax over a boolean mask returns the first action that is (near-)optimal
+        return np.argmax(receiver_eu >= receiver_eu.max(axis=0) - self.tie_tolerance, axis=0)
 
     def calculate_sender_expected_utility(self, signaling_scheme):
         """
         Calculate the Sender's total expected utility.
         E[U_S] = Sum_w P(w) * [ Sum_m P(m | w) * U_S(a*(m), w) ]
-        """
-        # 1. Get all possible signals M from the scheme
-        signals = set()
-        for state_signals in signaling_scheme.values():
-            signals.update(state_signals.keys())
-            
-        # 2. For each signal m, find the receiver's optimal action a*(m)
-        optimal_action_for_signal = {}
-        prob_of_signal = {} # Store P(m)
         
-        for signal in signals:
-            posterior_belief, prob_m = self._calculate_posterior_belief(signal, signaling_scheme)
-            optimal_action_for_signal[signal] = self._get_receiver_optimal_action(posterior_belief)
-            prob_of_signal[signal] = prob_m
+        signaling_scheme is either a dict {state: {signal: P(m | w)}} or a
+        precomputed (S, M) matrix pi whose rows follow self.states.
+        """
+        # 1. Get the scheme as an (S, M) matrix pi[w, m] = P(m | w)
+        if isinstance(signaling_scheme, np.ndarray):
+            pi = signaling_scheme
+        else:
+            pi = self._scheme_to_matrix(signaling_scheme)
 
-        # 3. Calculate Sender's total expected utility
-        total_expected_utility = 0.0
-        
-        for state in self.states:
-            utility_for_state = 0.0
-            for signal in signals:
-                prob_signal_given_state = signaling_scheme[state].get(signal, 0) # P(m | w)
-                action_taken = optimal_action_for_signal[signal] # a*(m)
-                sender_utility = self.u_s[action_taken][state] # U_S(a*(m), w)
-                
-                utility_for_state += prob_signal_given_state * sender_utility
-                
-            total_expected_utility += self.prior[state] * utility_for_state # Sum_w P(w) * [...]
-            
-        return total_expected_utility
\ No newline at end of file
+        kernel = _compiled_eu_kernel() if USE_NUMBA else None
+        if kernel is not None:
+            # Compiled version of steps 2-4
+            pi = np.ascontiguousarray(pi, dtype=np.float64)
+            return float(kernel(pi, self.prior_v, self.Us, self.Ur, self.tie_tolerance))
+
+        # 2. Joint table and posteriors for all signals at once
+        p_joint, posterior = self._signal_posteriors(pi)
+
+        # 3. Receiver's optimal action a*(m) for every signal, (M,)
+        a_star = self._receiver_best_actions(posterior)
+
+        # 4. Sender's total expected utility: Sum_{w,m} P(w, m) * U_S(a*(m), w)
+        return float((p_joint * self.Us[a_star].T).sum())
+
+    def _utility_from_scheme_key(self, key):
+        return self.calculate_sender_expected_utility({state: dict(signals) for state, signals in key})
+
+    def calculate_sender_expected_utility_cached(self, signaling_scheme):
+        """
+        Same as calculate_sender_expected_utility for a dict scheme, but memoized:
+        LLMs often return identical schemes for the same prompt (especially at low
+        temperature), and those are only evaluated once per simulator.
+        """
+        return self._utility_by_scheme_key(scheme_key(signaling_scheme))
@@ -0,0 +1,172 @@
+import importlib.util
+import os
+import sys
+import unittest
+from unittest import mock
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simulator
+from simulator import BayesianGameSimulator
+
+def reference_sender_expected_utility(sim, signaling_scheme):
+    """
+    The original loop implementation of calculate_sender_expected_utility, kept as
+    the reference. The only change is the tie rule: the Receiver takes the first
+    action within sim.tie_tolerance of the best instead of the first exact maximum.
+    """
+    signals = []
+    for state_signals in signaling_scheme.values():
+        for signal in state_signals:
+            if signal not in signals:
+                signals.append(signal)
+
+    total_expected_utility = 0.0
+    for signal in signals:
+        prob_signal = 0.0 # P(signal)
+        for state in sim.states:
+            prob_signal += signaling_scheme[state].get(signal, 0) * sim.prior[state]
+        if prob_signal == 0:
+            continue
+
+        posterior_belief = {}
+        for state in sim.states:
+            posterior_belief[state] = signaling_scheme[state].get(signal, 0) * sim.prior[state] / prob_signal
+
+        expected_utilities = []
+        for action in sim.actions:
+            expected_utility = 0.0
+            for state in sim.states:
+                expected_utility += sim.u_r[action][state] * posterior_belief[state]
+            expected_utilities.append(expected_utility)
+        best = max(expected_utilities)
+        action_taken = next(action for action, expected_utility in zip(sim.actions, expected_utilities)
+                            if expected_utility >= best - sim.tie_tolerance)
+
+        for state in sim.states:
+            total_expected_utility += (sim.prior[state] * signaling_scheme[state].get(signal, 0)
+                                       * sim.u_s[action_taken][state])
+    return total_expected_utility
+
+def random_game(rng):
+    """
+    A random game with small integer utilities on a random scale, so that exact
+    ties come up often: duplicate actions, and actions that tie with the first one
+    under the prior (i.e. after any pooled signal) only up to rounding noise.
+    """
+    n_states = int(rng.integers(2, 5))
+    n_actions = int(rng.integers(2, 5))
+    states = [f"w{i}" for i in range(n_states)]
+    actions = [f"a{i}" for i in range(n_actions)]
+    scale = float(rng.choice([1e-10, 1.0, 1e9]))
+
+    prior_v = rng.dirichlet(np.ones(n_states))
+    u_s = rng.integers(-3, 4, size=(n_actions, n_states)).astype(float)
+    u_r = rng.integers(-3, 4, size=(n_actions, n_states)) * scale
+    if rng.random() < 0.3:
+        u_r[-1] = u_r[0] # An exact duplicate of the first action
+    if rng.random() < 0.5:
+        # Moving utility between two states in proportion to the prior leaves the
+        # expected utility under the prior unchanged
+        i, j = rng.choice(n_states, size=2, replace=False)
+        u_r[1] = u_r[0]
+        u_r[1, i] += prior_v[j] * scale
+        u_r[1, j] -= prior_v[i] * scale
+
+    prior = dict(zip(states, prior_v))
+    sender_utility = {a: dict(zip(states, u_s[i])) for i, a in enumerate(actions)}
+    receiver_utility = {a: dict(zip(states, u_r[i])) for i, a in enumerate(actions)}
+    return BayesianGameSimulator(states, actions, prior, sender_utility, receiver_utility)
+
+def random_scheme(rng, states):
+    n_signals = int(rng.integers(1, 5))
+    signals = [f"m{j}" for j in range(n_signals)]
+    if rng.random() < 0.3:
+        # Pooling: the same signal distribution in every state, so every posterior is the prior
+        row = rng.dirichlet(np.ones(n_signals))
+        return {state: dict(zip(signals, row)) for state in states}
+    scheme = {}
+    for state in states:
+        row = rng.dirichlet(np.ones(n_signals))
+        row[rng.random(n_signals) < 0.2] = 0.0 # Some signals are never sent from this state
+        if row.sum() == 0:
+            row[0] = 1.0
+        scheme[state] = dict(zip(signals, row / row.sum()))
+    return scheme
+
+class TestSenderExpectedUtility(unittest.TestCase):
+
+    NUM_GAMES = 300
+    SCHEMES_PER_GAME = 5
+
+    def _cases(self):
+        rng = np.random.default_rng(2502)
+        for _ in range(self.NUM_GAMES):
+            sim = random_game(rng)
+            for _ in range(self.SCHEMES_PER_GAME):
+                yield sim, random_scheme(rng, sim.states)
+
+    def assertUtilityEqual(self, actual, expected, sim):
+        # Utilities are sums of U_S(a, w) weighted by probabilities, so compare on their scale
+        tolerance = 1e-9 * max(1.0, np.abs(sim.Us).max())
+        self.assertAlmostEqual(actual, expected, delta=tolerance)
+
+    def test_numpy_path_matches_reference(self):
+        with mock.patch.object(simulator, "USE_NUMBA", False):
+            for sim, scheme in self._cases():
+                self.assertUtilityEqual(sim.calculate_sender_expected_utility(scheme),
+                                        reference_sender_expected_utility(sim, scheme), sim)
+
+    @unittest.skipIf(importlib.util.find_spec("numba") is None, "numba is not installed")
+    def test_numba_kernel_matches_reference(self):
+        kernel = simulator._compiled_eu_kernel()
+        for sim, scheme in self._cases():
+            pi = sim._scheme_to_matrix(scheme)
+            self.assertUtilityEqual(float(kernel(pi, sim.prior_v, sim.Us, sim.Ur, sim.tie_tolerance)),
+                                    reference_sender_expected_utility(sim, scheme), sim)
+
+    def _indifferent_games(self):
+        # Accept and Reject tie exactly under the prior, so every pooled signal must go to Accept
+        for scale in (1e-10, 1.0, 1e9):
+            yield BayesianGameSimulator(
+                states=['H', 'L'],
+                actions=['Accept', 'Reject'],
+                prior={'H': 0.3, 'L': 0.7},
+                sender_utility={'Accept': {'H': 1.0, 'L': 1.0}, 'Reject': {'H': 0.0, 'L': 0.0}},
+                receiver_utility={'Accept': {'H': 0.7 * scale, 'L': -0.3 * scale},
+                                  'Reject': {'H': 0.0, 'L': 0.0}}
+            )
+
+    def _pooled_schemes(self):
+        for q in np.linspace(0.01, 1.0, 100):
+            yield {'H': {'a': q, 'b': 1 - q}, 'L': {'a': q, 'b': 1 - q}}
+
+    def test_indifferent_receiver_picks_first_action_at_any_scale(self):
+        with mock.patch.object(simulator, "USE_NUMBA", False):
+            for sim in self._indifferent_games():
+                for scheme in self._pooled_schemes():
+                    self.assertAlmostEqual(sim.calculate_sender_expected_utility(scheme), 1.0, places=9)
+
+    @unittest.skipIf(importlib.util.find_spec("numba") is None, "numba is not installed")
+    def test_numba_kernel_indifferent_receiver_picks_first_action_at_any_scale(self):
+        kernel = simulator._compiled_eu_kernel()
+        for sim in self._indifferent_games():
+            for scheme in self._pooled_schemes():
+                pi = sim._scheme_to_matrix(scheme)
+                self.assertAlmostEqual(float(kernel(pi, sim.prior_v, sim.Us, sim.Ur, sim.tie_tolerance)), 1.0,
+                                       places=9)
+
+    def test_small_utility_differences_are_not_ties(self):
+        sim = BayesianGameSimulator(
+            states=['H'],
+            actions=['A', 'B'],
+            prior={'H': 1.0},
+            sender_utility={'A': {'H': 0.0}, 'B': {'H': 1.0}},
+            receiver_utility={'A': {'H': 1e-10}, 'B': {'H': 2e-10}}
+        )
+        self.assertEqual(sim.calculate_sender_expected_utility({'H': {'m': 1.0}}), 1.0)
+
+if __name__ == "__main__":
+    unittest.main()